@@ -4,7 +4,6 @@ Concordia package and workflow.
 
 from importlib.metadata import version as _version
 
-from .report import add_hypothesis, add_plotly_header, add_sticky_toc, embed_image
 from .utils import (
     CondordiaMagics,
     RegionMapping,
@@ -18,3 +17,26 @@ except Exception:
     # Local copy or not installed with setuptools.
     # Disable minimum version checks on downstream libraries.
     __version__ = "999"
+
+
+# Reporting helpers pull in matplotlib and dominate and are loaded on first access
+_report_attrs = {"add_hypothesis", "add_plotly_header", "add_sticky_toc", "embed_image"}
+
+__all__ = [
+    "CondordiaMagics",
+    "RegionMapping",
+    "VariableDefinitions",
+    *sorted(_report_attrs),
+]
+
+
+def __getattr__(name):
+    if name in _report_attrs:
+        from . import report
+
+        return getattr(report, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | _report_attrs)
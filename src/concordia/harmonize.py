@@ -7,7 +7,7 @@ from pandas_indexing import concat, isin
 from aneris.harmonize import Harmonizer
 
 from .settings import Settings
-from .utils import add_totals, aggregate_subsectors, skipnone
+from .utils import add_totals, aggregate_subsectors, semijoin_right, skipnone
 
 
 def _harmonize(
@@ -32,9 +32,7 @@ def _harmonize(
         methods = h.methods_used
         if isinstance(methods, pd.DataFrame):
             methods = methods["method"]
-        result = result.pix.assign(
-            method=methods.pix.semijoin(result.index, how="right")
-        )
+        result = result.pix.assign(method=semijoin_right(methods, result.index))
         harmonized.append(result.pix.assign(model=m, scenario=s))
 
     return concat(harmonized) if harmonized else None
@@ -1,3 +1,6 @@
+import copy
+import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Self
 
@@ -7,9 +10,23 @@ from cattrs import structure, transform_error
 from cattrs.errors import ClassValidationError
 
 
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
+
 Pathy = str | Path
 
 
+@lru_cache(maxsize=32)
+def _load_yaml_cached(path_str: str, mtime_ns: int, size: int) -> dict:
+    # mtime_ns and size are only part of the cache key, so that the cache is
+    # invalidated when the file changes
+    with open(path_str) as f:
+        return yaml.load(f, Loader=_SafeLoader)
+
+
 @define
 class FtpSettings:
     server: str
@@ -51,10 +68,19 @@ class Settings:
 
     @staticmethod
     def resolve_paths(config, base_path=None):
+        # Each referenced path is only resolved once, even if it is used by
+        # several other paths
+        resolved = {}
+
+        def resolve(key):
+            if key not in resolved:
+                resolved[key] = expand(config[key])
+            return resolved[key]
+
         def expand(path):
             if path[0] == "$":
                 reference, relative = path[1:].split("/", 1)
-                return expand(config[reference]) / relative
+                return resolve(reference) / relative
 
             if base_path is not None:
                 return (base_path / path).expanduser()
@@ -62,7 +88,7 @@ class Settings:
             return Path(path).expanduser()
 
         expanded = {
-            key: (expand(val) if key.endswith("_path") else val)
+            key: (resolve(key) if key.endswith("_path") else val)
             for key, val in config.items()
         }
 
@@ -87,8 +113,11 @@ class Settings:
             base_path = Path(base_path)
             config_path = base_path / config_path
 
-        with open(config_path) as f:
-            config = yaml.safe_load(f)
+        config_path = os.path.abspath(config_path)
+        stat = os.stat(config_path)
+        config = copy.deepcopy(
+            _load_yaml_cached(config_path, stat.st_mtime_ns, stat.st_size)
+        )
 
         # TODO might want to replace with merge for nested dictionaries
         try:
@@ -70,6 +70,15 @@ class VariableDefinitions:
     def proxies(self):
         return pd.Index(self.data["proxy_name"].unique()).dropna()
 
+    @property
+    def short_sector(self) -> pd.Index:
+        """Sector without subsector (Energy Sector for Energy Sector|Modelled)."""
+        # Only split the unique sector labels
+        codes, sectors = pd.factorize(
+            self.index.get_level_values("sector"), use_na_sentinel=False
+        )
+        return sectors.str.split("|").str[0].take(codes)
+
     @property
     def downscaling(self):
         data = self.data
@@ -400,45 +409,47 @@ def as_seaborn(df: DataFrame, meta: DataFrame | None = None, value_name: str = "
     return df.reset_index()
 
 
+def semijoin_right(
+    df: pd.DataFrame | pd.Series, index: pd.Index
+) -> pd.DataFrame | pd.Series:
+    """Right semijoin `df` with `index`, skipped if `df` is indexed by `index`."""
+    if df.index.names == index.names and df.index.equals(index):
+        return df
+    return df.pix.semijoin(index, how="right")
+
+
 def skipnone(*args):
     if len(args) == 1 and (is_list_like(args[0]) or is_iterator(args[0])):
         args = args[0]
     return [x for x in args if x is not None]
 
 
-def add_zeros_like(
-    df: pd.DataFrame,
+def zeros_index_like(
+    target_levels: Sequence[str],
     reference: pd.MultiIndex | pd.DataFrame | pd.Series,
     /,
     derive: dict[str, pd.MultiIndex] | None = None,
     **levels: Sequence[str],
-):
-    """Adds explicit `levels` to `df` as 0 values.
-
-    Remaining levels in `df` not found in `levels` or `derive` are taken from
-    `reference` (or its index).
+) -> pd.MultiIndex | None:
+    """Index of the zero entries `add_zeros_like` adds.
 
-    df : DataFrame
-        data in time-series representation with years on columns
+    target_levels : [str]
+        levels of the resulting index
     reference : [str]
         expected level labels (like model, scenario combinations)
     derive : dict
         derive labels in a level from a multiindex with allowed combinations
     **levels : [str]
-        which labels should be added to df
+        which labels should be added
 
     Returns
     -------
-    DataFrame
-        unsorted data with additional zero data
-
-    Note
-    ----
-    May lead to duplicates!
+    MultiIndex or None
+        index with levels `target_levels` or None if there is nothing to add
     """
 
     if any(len(labels) == 0 for labels in levels.values()):
-        return df
+        return None
 
     if isinstance(reference, pd.Series | pd.DataFrame):
         reference = reference.index
@@ -449,27 +460,68 @@ def add_zeros_like(
     if derive is None:
         derive = {}
 
-    target_levels = df.index.names
     index = reference.pix.unique(
-        target_levels.difference(levels.keys()).difference(derive.keys())
+        [l for l in target_levels if l not in levels and l not in derive]
     )
 
+    indices = [
+        reduce(
+            lambda ind, d: ind.join(d, how="left"),
+            derive.values(),
+            index.pix.assign(**dict(zip(levels.keys(), labels))),
+        ).reorder_levels(target_levels)
+        for labels in product(*levels.values())
+    ]
+    return indices[0].append(indices[1:])
+
+
+def add_zeros(df: pd.DataFrame, *indices: pd.MultiIndex | None) -> pd.DataFrame:
+    """Adds 0 values for all entries in `indices` to `df`.
+
+    Missing indices (None) are skipped, so that results of `zeros_index_like`
+    can be collected and added in a single go.
+    """
+    indices = skipnone(indices)
+    if not indices:
+        return df
+
     return concat(
-        [df]
-        + [
-            pd.DataFrame(
-                0,
-                index=(
-                    reduce(
-                        lambda ind, d: ind.join(d, how="left"),
-                        derive.values(),
-                        index.pix.assign(**dict(zip(levels.keys(), labels))),
-                    ).reorder_levels(target_levels)
-                ),
-                columns=df.columns,
-            )
-            for labels in product(*levels.values())
-        ]
+        [df, pd.DataFrame(0, index=indices[0].append(indices[1:]), columns=df.columns)]
+    )
+
+
+def add_zeros_like(
+    df: pd.DataFrame,
+    reference: pd.MultiIndex | pd.DataFrame | pd.Series,
+    /,
+    derive: dict[str, pd.MultiIndex] | None = None,
+    **levels: Sequence[str],
+):
+    """Adds explicit `levels` to `df` as 0 values.
+
+    Remaining levels in `df` not found in `levels` or `derive` are taken from
+    `reference` (or its index).
+
+    df : DataFrame
+        data in time-series representation with years on columns
+    reference : [str]
+        expected level labels (like model, scenario combinations)
+    derive : dict
+        derive labels in a level from a multiindex with allowed combinations
+    **levels : [str]
+        which labels should be added to df
+
+    Returns
+    -------
+    DataFrame
+        unsorted data with additional zero data
+
+    Note
+    ----
+    May lead to duplicates!
+    """
+    return add_zeros(
+        df, zeros_index_like(df.index.names, reference, derive=derive, **levels)
     )
 
 
@@ -3,18 +3,18 @@ from __future__ import annotations
 import logging
 import re
 import textwrap
-from collections import namedtuple
 from collections.abc import Callable, Iterator, Sequence
-from functools import cached_property
-from itertools import chain
+from functools import cached_property, lru_cache
+from itertools import chain, islice
 
 import dask
+import numpy as np
 import pandas as pd
 import ptolemy as pt
-from attrs import define
+import xarray as xr
+from attrs import define, field
 from pandas_indexing import concat, isin
 from pandas_indexing.utils import print_list
-from tqdm.auto import tqdm
 
 from .downscale import downscale
 from .grid import Gridded, Proxy
@@ -24,53 +24,169 @@ from .utils import (
     Pathy,
     RegionMapping,
     VariableDefinitions,
-    add_zeros_like,
+    add_zeros,
     aggregate_subsectors,
     skipnone,
+    zeros_index_like,
 )
 
 
 logger = logging.getLogger(__name__)
 
-CountryGroup = namedtuple("CountryGroup", ["countries", "variables"])
+
+@define(frozen=True)
+class CountryGroup:
+    countries: pd.Index
+    variables: pd.MultiIndex
+
+
+_MASS_FLOW_UNIT = re.compile(r"(?:Gt|Mt|kt|t|kg) (.*)/yr")
+
+
+@lru_cache
+def kg_per_second_unit(unit: str) -> str:
+    """Map a mass flow unit like ``Mt CO2/yr`` to ``kg CO2/s``."""
+    return _MASS_FLOW_UNIT.sub(r"kg \1/s", unit)
 
 
 def log_uncovered_history(
     hist: pd.DataFrame, hist_agg: pd.DataFrame, threshold=0.01, base_year: int = 2020
 ) -> None:
     levels = ["gas", "sector", "unit"]
-    hist_total = hist.loc[~isin(country="World"), base_year].groupby(levels).sum()
-    hist_covered = hist_agg.loc[:, base_year].groupby(levels).sum()
-    hist_uncovered = hist_total - hist_covered
-    hist_stats = pd.DataFrame(
-        dict(uncovered=hist_uncovered, rel=hist_uncovered / hist_total)
+
+    def project(s):
+        return s.droplevel([n for n in s.index.names if n not in levels])
+
+    hist_stats = (
+        pd.concat(
+            {
+                "total": project(hist.loc[~isin(country="World"), base_year]),
+                "covered": project(hist_agg.loc[:, base_year]),
+            },
+            names=["kind"],
+        )
+        .groupby(["kind"] + levels)
+        .sum()
+        .unstack("kind")
+        # an empty hist_agg (for the group of variables with empty proxies)
+        # leaves no covered column, groups missing on either side stay nan
+        .reindex(columns=["total", "covered"])
     )
+    hist_total = hist_stats["total"]
+    hist_uncovered = hist_total - hist_stats["covered"]
     loglevel = (
         logging.WARN
         if (hist_uncovered > threshold * hist_total + 1e-6).any()
         else logging.INFO
     )
+    if not logger.isEnabledFor(loglevel):
+        return
+
+    hist_stats = pd.DataFrame(
+        dict(uncovered=hist_uncovered, rel=hist_uncovered / hist_total)
+    ).sort_values("rel", ascending=False)
+    index = hist_stats.index
     logger.log(
         loglevel,
         "Historical emissions in countries missing from proxy:"
         + "".join(
             "\n"
-            + "::".join(t.Index[:2])
-            + f" - {t.uncovered:.02f} {t.Index[2]} ({t.rel * 100:.01f}%)"
-            for t in hist_stats.sort_values("rel", ascending=False).itertuples()
+            + index.get_level_values("gas")
+            + "::"
+            + index.get_level_values("sector")
+            + " - "
+            + hist_stats["uncovered"].map("{:.02f}".format).values
+            + " "
+            + index.get_level_values("unit")
+            + " ("
+            + (hist_stats["rel"] * 100).map("{:.01f}%".format).values
+            + ")"
+        ),
+    )
+
+
+def absolute_variable_weights(
+    weights: Sequence[xr.DataArray], variables: pd.MultiIndex
+) -> pd.Series:
+    """Absolute proxy weights brought into the same form as `variables`.
+
+    There are three different types of variables in the result:
+    1. those that did not show up in the proxies (here with nan)
+    2. those that did not have any associated weight
+    3. those that had proxy weight for some countries
+    """
+    weights = concat([w.to_series() for w in weights])
+    return abs(
+        weights.rename_axis(index={"sector": "short_sector"}).pix.semijoin(
+            variables, how="right"
+        )
+    )
+
+
+def total_weight_per_variable(abs_weights: pd.Series) -> pd.Series:
+    """Total weight for each variable, nan for variables without any weight.
+
+    Equivalent to ``abs_weights.groupby(["gas", "sector"]).sum(min_count=1)``,
+    but reduces directly on the integer codes of the index levels.
+    """
+    index = abs_weights.index
+    gas = index.names.index("gas")
+    sector = index.names.index("sector")
+    gases, sectors = index.levels[gas], index.levels[sector]
+
+    # Combine gas and sector codes into a single integer key
+    key = index.codes[gas].astype(np.int64) * len(sectors) + index.codes[sector]
+    n_keys = len(gases) * len(sectors)
+
+    values = abs_weights.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    present = np.flatnonzero(np.bincount(key, minlength=n_keys))
+    total = np.bincount(key, weights=np.where(valid, values, 0), minlength=n_keys)
+    count = np.bincount(key, weights=valid, minlength=n_keys)
+
+    return pd.Series(
+        np.where(count[present] > 0, total[present], np.nan),
+        index=pd.MultiIndex.from_arrays(
+            [gases[present // len(sectors)], sectors[present % len(sectors)]],
+            names=["gas", "sector"],
         ),
+    ).sort_index()
+
+
+def weight_countries_per_variable(
+    abs_weights: pd.Series, countries: pd.Index
+) -> pd.Series:
+    """Sorted tuple of `countries` with positive weight for each variable."""
+    return (
+        abs_weights.index[
+            (abs_weights > 0) & abs_weights.index.isin(countries, level="country")
+        ]
+        .to_frame(index=False)
+        .sort_values(["gas", "sector", "country"], kind="stable")
+        .groupby(["gas", "sector"], sort=False)
+        .country.agg(tuple)
     )
 
 
+def _reset_data(instance, attribute, value):
+    instance._data = None
+    return value
+
+
 @define
 class GlobalRegional:
-    globallevel: pd.DataFrame | None = None
-    regionlevel: pd.DataFrame | None = None
-    countrylevel: pd.DataFrame | None = None
+    globallevel: pd.DataFrame | None = field(default=None, on_setattr=_reset_data)
+    regionlevel: pd.DataFrame | None = field(default=None, on_setattr=_reset_data)
+    countrylevel: pd.DataFrame | None = field(default=None, on_setattr=_reset_data)
+
+    # concatenated levels, reset whenever one of the levels is re-assigned
+    _data: pd.DataFrame | None = field(default=None, init=False, repr=False, eq=False)
 
     @property
     def data(self):
-        return concat([self.globallevel, self.regionlevel, self.countrylevel])
+        if self._data is None:
+            self._data = concat([self.globallevel, self.regionlevel, self.countrylevel])
+        return self._data
 
 
 @define(slots=False)
@@ -90,16 +206,23 @@ class WorkflowDriver:
     harmonized: GlobalRegional = GlobalRegional()
     downscaled: GlobalRegional = GlobalRegional()
 
+    @cached_property
+    def variabledefs_per_proxy(self) -> dict[str, VariableDefinitions]:
+        return {
+            proxy_name: self.variabledefs.for_proxy(proxy_name)
+            for proxy_name in self.variabledefs.proxies
+        }
+
     @cached_property
     def proxies(self):
         return {
             proxy_name: Proxy.from_variables(
-                self.variabledefs.for_proxy(proxy_name),
+                variabledefs,
                 dict(country=self.indexraster_country, region=self.indexraster_region),
                 self.settings.proxy_path,
                 as_flux=True,
             )
-            for proxy_name in self.variabledefs.proxies
+            for proxy_name, variabledefs in self.variabledefs_per_proxy.items()
         }
 
     def country_groups(
@@ -115,54 +238,31 @@ class WorkflowDriver:
 
         # determine proxy weights for all related proxy variables
         regional_proxies = variabledefs.proxies
-        variable_weights = [
-            w.to_series()
-            for w in dask.compute(
-                *[
-                    proxy.weight.countrylevel.sum("year")
-                    for proxy_name, proxy in self.proxies.items()
-                    if proxy_name in regional_proxies
-                    and proxy.weight.countrylevel is not None
-                ]
-            )
-        ]
+        weights = dask.compute(
+            *[
+                proxy.weight.countrylevel.sum("year")
+                for proxy_name, proxy in self.proxies.items()
+                if proxy_name in regional_proxies
+                and proxy.weight.countrylevel is not None
+            ]
+        )
 
-        if not variable_weights:
+        if not weights:
             # No proxies, so all variables fall into one group with all countries
             country_groups = [(all_countries, variabledefs.index)]
         else:
-            variable_weights = concat(variable_weights)
-
             # Add a short_sector (which is Energy Sector for Energy Sector|Modelled)
             variables = variabledefs.index.pix.assign(
-                short_sector=variabledefs.index.pix.project("sector")
-                .str.split("|")
-                .str[0]
+                short_sector=variabledefs.short_sector
             )
 
-            # Bring weights into the same form as the variables we want,
-            # there are three different types of variables now:
-            # 1. those that did not show up in the proxies (here with nan)
-            # 2. those that did not have any associated weight
-            # 3. those that had proxy weight for some countries
-            variable_weights = variable_weights.rename_axis(
-                index={"sector": "short_sector"}
-            ).pix.semijoin(variables, how="right")
-
-            total_weight = (
-                abs(variable_weights).groupby(["gas", "sector"]).sum(min_count=1)
-            )
+            abs_weights = absolute_variable_weights(weights, variables)
+            total_weight = total_weight_per_variable(abs_weights)
+            # Only consider countries which we can harmonize and downscale
+            weight_countries = weight_countries_per_variable(abs_weights, all_countries)
 
             noproxy_vars = total_weight.index[total_weight.isna()]
             emptyproxy_vars = total_weight.index[total_weight == 0]
-            weight_countries = (
-                variable_weights.index[abs(variable_weights) > 0]
-                # Only consider countries which we can harmonize and downscale
-                .join(all_countries, how="inner")
-                .to_frame()
-                .country.groupby(["gas", "sector"])
-                .apply(lambda s: tuple(sorted(s)))
-            )
 
             country_groups = chain(
                 [
@@ -270,37 +370,45 @@ class WorkflowDriver:
             "Harmonizing and downscaling %d variables to country level",
             len(variabledefs.countrylevel.index),
         )
-        history_aggregated = []
-        harmonized = []
-        downscaled = []
+        # Zero entries for missing regions and countries are only collected in
+        # the loop and added to the concatenated results at the end
+        history_aggregated, history_aggregated_zeros = [], []
+        harmonized, harmonized_zeros = [], []
+        downscaled, downscaled_zeros = [], []
+        all_regions = set(self.regionmapping.data.unique())
+        all_countries = self.regionmapping.data.index
         for group in self.country_groups(variabledefs):
             regionmapping = self.regionmapping.filter(group.countries)
-            missing_regions = set(self.regionmapping.data.unique()).difference(
-                regionmapping.data.unique()
-            )
-            missing_countries = self.regionmapping.data.index.difference(
-                group.countries
-            )
+            regions = regionmapping.data.unique()
+            missing_regions = all_regions.difference(regions)
+            missing_countries = all_countries.difference(group.countries)
 
             model = self.model.pix.semijoin(group.variables, how="right")
             hist = self.hist.pix.semijoin(group.variables, how="right")
             hist_agg = regionmapping.aggregate(hist, dropna=True)
 
             log_uncovered_history(hist, hist_agg, base_year=self.settings.base_year)
-            history_aggregated.append(
-                add_zeros_like(hist_agg, hist, region=missing_regions)
+            history_aggregated.append(hist_agg)
+            history_aggregated_zeros.append(
+                zeros_index_like(hist_agg.index.names, hist, region=missing_regions)
             )
 
             harm = harmonize(
-                model.loc[isin(region=regionmapping.data.unique())],
+                model.loc[isin(region=regions)],
                 hist_agg,
                 overrides=self.harm_overrides.pix.semijoin(
                     group.variables, how="inner"
                 ),
                 settings=self.settings,
             )
-            harmonized.append(
-                add_zeros_like(harm, model, region=missing_regions, method=["all_zero"])
+            harmonized.append(harm)
+            harmonized_zeros.append(
+                zeros_index_like(
+                    harm.index.names,
+                    model,
+                    region=missing_regions,
+                    method=["all_zero"],
+                )
             )
 
             harm = aggregate_subsectors(harm.droplevel("method"))
@@ -313,9 +421,10 @@ class WorkflowDriver:
                 regionmapping,
                 settings=self.settings,
             )
-            downscaled.append(
-                add_zeros_like(
-                    down,
+            downscaled.append(down)
+            downscaled_zeros.append(
+                zeros_index_like(
+                    down.index.names,
                     harm,
                     country=missing_countries,
                     method=["all_zero"],
@@ -326,9 +435,13 @@ class WorkflowDriver:
         if not downscaled:
             return
 
-        self.history_aggregated.countrylevel = concat(history_aggregated)
-        self.harmonized.countrylevel = concat(harmonized)
-        downscaled = self.downscaled.countrylevel = concat(downscaled)
+        self.history_aggregated.countrylevel = add_zeros(
+            concat(history_aggregated), *history_aggregated_zeros
+        )
+        self.harmonized.countrylevel = add_zeros(concat(harmonized), *harmonized_zeros)
+        downscaled = self.downscaled.countrylevel = add_zeros(
+            concat(downscaled), *downscaled_zeros
+        )
 
         return downscaled.droplevel(["method", "region"])
 
@@ -346,35 +459,81 @@ class WorkflowDriver:
             )
         )
 
-    def grid_proxy(self, proxy_name: str, downscaled: pd.DataFrame | None = None):
-        proxy = self.proxies[proxy_name]
-
-        variabledefs = self.variabledefs.for_proxy(proxy_name)
-        if downscaled is None:
-            downscaled = self.harmonize_and_downscale(variabledefs)
-        else:
-            downscaled = downscaled.pix.semijoin(
-                variabledefs.downscaling.index, how="inner"
-            )
+    def hist_for_gridding(self) -> pd.DataFrame:
+        """Historical data on the country and region level without base year.
 
+        Depends on the region level history aggregated by
+        `harmdown_regionlevel`, so it must be re-computed after harmonizing.
+        """
         hist_region = self.history_aggregated.regionlevel
         if hist_region is not None:
             hist_region = hist_region.rename_axis(index={"region": "country"})
-        hist = aggregate_subsectors(
+        return aggregate_subsectors(
             concat(skipnone(self.hist, hist_region)).drop(
                 self.settings.base_year, axis=1
             )
         )
+
+    def partition_by_proxy(self, downscaled: pd.DataFrame) -> dict[str, pd.DataFrame]:
+        """Split downscaled data into the parts gridded by each proxy.
+
+        Equivalent to semijoining `downscaled` with the downscaling variables
+        of each proxy in turn, but needs only a single pass over `downscaled`.
+        """
+        proxy_indices = [
+            self.variabledefs_per_proxy[proxy_name].downscaling.index.pix.assign(
+                proxy=proxy_name
+            )
+            for proxy_name in self.proxies
+        ]
+        if not proxy_indices:
+            return {}
+
+        partitions = dict(
+            list(
+                downscaled.pix.semijoin(
+                    proxy_indices[0].append(proxy_indices[1:]), how="inner"
+                ).groupby(level="proxy", sort=False)
+            )
+        )
+        return {
+            proxy_name: (
+                partitions[proxy_name].droplevel("proxy")
+                if proxy_name in partitions
+                else downscaled.iloc[:0]
+            )
+            for proxy_name in self.proxies
+        }
+
+    def grid_proxy(
+        self,
+        proxy_name: str,
+        downscaled: pd.DataFrame | None = None,
+        hist: pd.DataFrame | None = None,
+        partitioned: bool = False,
+    ):
+        proxy = self.proxies[proxy_name]
+
+        variabledefs = self.variabledefs_per_proxy[proxy_name]
+        if downscaled is None:
+            downscaled = self.harmonize_and_downscale(variabledefs)
+        elif not partitioned:
+            # `downscaled` might hold data for all proxies, unless it was
+            # already split with `partition_by_proxy`
+            downscaled = downscaled.pix.semijoin(
+                variabledefs.downscaling.index, how="inner"
+            )
+
+        if hist is None:
+            hist = self.hist_for_gridding()
         downscaled, hist = downscaled.align(hist, join="left", axis=0)
         tabular = concat([hist, downscaled], axis=1)
 
         # Convert unit to kg/s of the repective gas
-        tabular = tabular.pix.convert_unit(
-            lambda s: re.sub("(?:Gt|Mt|kt|t|kg) (.*)/yr", r"kg \1/s", s)
-        )
+        tabular = tabular.pix.convert_unit(kg_per_second_unit)
 
-        for model, scenario in tabular.pix.unique(["model", "scenario"]):
-            yield proxy.grid(tabular.loc[isin(model=model, scenario=scenario)])
+        for _, pathway in tabular.groupby(level=["model", "scenario"], sort=False):
+            yield proxy.grid(pathway)
 
     def grid(
         self,
@@ -384,7 +543,13 @@ class WorkflowDriver:
         encoding_kwargs: dict | None = None,
         verify: bool = True,
         skip_exists: bool = False,
+        batch_size: int = 4,
     ):
+        from tqdm.auto import tqdm
+
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, not {batch_size}")
+
         def verify_and_save(pathways: Sequence[Gridded]):
             def skip(gridded, template_fn, directory):
                 fname = gridded.fname(template_fn, directory)
@@ -396,8 +561,8 @@ class WorkflowDriver:
                     )
                 return to_skip
 
-            return dask.compute(
-                (
+            def save(gridded):
+                return (
                     gridded.to_netcdf(
                         template_fn,
                         callback,
@@ -407,14 +572,28 @@ class WorkflowDriver:
                     ),
                     gridded.verify(compute=False) if verify else None,
                 )
+
+            # Compute in batches, so that writing the first pathways does not
+            # have to wait until all of them have been gridded
+            pathways = (
+                gridded
                 for gridded in pathways
                 if not skip(gridded, template_fn, directory)
             )
+            results = []
+            while batch := list(islice(pathways, batch_size)):
+                results.extend(dask.compute(*map(save, batch)))
+            return (results,)
 
-        downscaled = self.harmonize_and_downscale()
+        downscaled = self.partition_by_proxy(self.harmonize_and_downscale())
+        hist = self.hist_for_gridding()
 
         return {
-            proxy_name: verify_and_save(self.grid_proxy(proxy_name, downscaled))
+            proxy_name: verify_and_save(
+                self.grid_proxy(
+                    proxy_name, downscaled[proxy_name], hist, partitioned=True
+                )
+            )
             for proxy_name in tqdm(self.proxies.keys())
         }
 
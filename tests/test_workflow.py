@@ -0,0 +1,96 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_series_equal
+
+from concordia.utils import RegionMapping
+from concordia.workflow import log_uncovered_history, total_weight_per_variable
+
+
+def weights(values, names=("country", "gas", "sector")):
+    index = pd.MultiIndex.from_tuples(
+        [
+            ("deu", "CO2", "Energy"),
+            ("fra", "CO2", "Energy"),
+            ("deu", "BC", "Energy"),  # all nan: no proxy
+            ("fra", "BC", "Energy"),
+            ("deu", "CO2", "Agri"),  # all zero: empty proxy
+            ("fra", "CO2", "Agri"),
+            ("deu", "BC", "Agri"),  # partially nan
+            ("fra", "BC", "Agri"),
+        ],
+        names=["country", "gas", "sector"],
+    )
+    return pd.Series(values, index=index, dtype=float).reorder_levels(list(names))
+
+
+def expected(abs_weights):
+    return abs_weights.groupby(["gas", "sector"]).sum(min_count=1)
+
+
+VALUES = [1.0, 2.0, np.nan, np.nan, 0.0, 0.0, np.nan, 3.0]
+
+
+@pytest.mark.parametrize(
+    "abs_weights",
+    [
+        weights(VALUES),
+        weights(VALUES, names=("sector", "country", "gas")),
+        # unused labels remain in the index levels
+        weights(VALUES).iloc[2:6],
+        weights(VALUES).iloc[:0],
+    ],
+)
+def test_total_weight_per_variable(abs_weights):
+    result = total_weight_per_variable(abs_weights)
+    assert_series_equal(result, expected(abs_weights), check_index_type=False)
+
+
+def test_total_weight_per_variable_nan_vs_zero():
+    result = total_weight_per_variable(weights(VALUES))
+    assert np.isnan(result[("BC", "Energy")])
+    assert result[("CO2", "Agri")] == 0
+    assert result[("BC", "Agri")] == 3
+
+
+@pytest.fixture
+def history():
+    index = pd.MultiIndex.from_tuples(
+        [
+            ("deu", "CO2", "Energy", "Mt CO2/yr"),
+            ("fra", "CO2", "Energy", "Mt CO2/yr"),
+            ("World", "CO2", "Energy", "Mt CO2/yr"),
+            ("deu", "BC", "Agri", "Mt BC/yr"),
+        ],
+        names=["country", "gas", "sector", "unit"],
+    )
+    return pd.DataFrame({2020: [1.0, 2.0, 5.0, 4.0]}, index=index)
+
+
+@pytest.fixture
+def regionmapping():
+    return RegionMapping(
+        pd.Series(["EUR", "EUR"], index=pd.Index(["deu", "fra"], name="country"))
+    )
+
+
+def test_log_uncovered_history(history, regionmapping, caplog):
+    hist_agg = regionmapping.filter(["deu"]).aggregate(history, dropna=True)
+    with caplog.at_level(logging.INFO):
+        log_uncovered_history(history, hist_agg, base_year=2020)
+
+    assert caplog.records[-1].levelno == logging.WARN
+    assert "CO2::Energy - 2.00 Mt CO2/yr (66.7%)" in caplog.text
+    assert "BC::Agri - 0.00 Mt BC/yr (0.0%)" in caplog.text
+
+
+def test_log_uncovered_history_empty(history, regionmapping, caplog):
+    # country group of variables with empty proxies
+    hist_agg = regionmapping.filter([]).aggregate(history, dropna=True)
+    with caplog.at_level(logging.INFO):
+        log_uncovered_history(history, hist_agg, base_year=2020)
+
+    assert "CO2::Energy - nan Mt CO2/yr (nan%)" in caplog.text
+    assert "BC::Agri - nan Mt BC/yr (nan%)" in caplog.text